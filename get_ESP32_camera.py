@@ -1,8 +1,11 @@
+import os
 import cv2
 import numpy as np
 
 import requests
 import sys
+import threading
+import time
 
 '''
 INFO SECTION
@@ -10,6 +13,10 @@ INFO SECTION
 - command can be sent through an HTTP get composed in the following way http://192.168.x.x/control?var=VARIABLE_NAME&val=VALUE (check varname and value in status)
 '''
 
+# one keep-alive session for all control requests to the camera
+_http = requests.Session()
+_http.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
 class ESP32Getter():
     def __init__(self, url, type="rtsp") -> None:
         # ESP32 self.URL
@@ -19,14 +26,41 @@ class ESP32Getter():
         if(type=="http"):
             self.cap = cv2.VideoCapture(f"http://{self.url}")
         elif(type=="rtsp"):
-            self.cap = cv2.VideoCapture(f"rtsp://{self.url}:554/mjpeg/1")
+            # appsink drops frames it cannot hand over instead of queueing them
+            self.cap = cv2.VideoCapture(f"rtspsrc location=rtsp://{self.url}:554/mjpeg/1 latency=0 ! rtpjpegdepay ! jpegdec ! videoconvert ! appsink max-buffers=1 drop=true sync=false", cv2.CAP_GSTREAMER)
+            if not self.cap.isOpened():
+                # OpenCV built without GStreamer: fall back to FFmpeg
+                # keep the FFmpeg backend from queueing packets on its side
+                os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;udp|buffer_size;65536|max_delay;0")
+                self.cap = cv2.VideoCapture(f"rtsp://{self.url}:554/mjpeg/1")
         else:
             sys.exit()
+        # retain only the newest frame so read() does not return stale ones
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
         
         self.set_resolution(index=8)
         # self.set_resolution(index=idx, verbose=True)
         # self.set_quality(value=val)
 
+        # keep draining the stream in the background so get_frame() always sees the newest frame
+        self._lock = threading.Lock()
+        self._latest = None
+        # bumped by the reader on every new frame, so callers can skip redrawing the same one
+        self.frame_count = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while not self._stop:
+            success, frame = self.cap.read()
+            with self._lock:
+                self._latest = frame if success else None
+                if success:
+                    self.frame_count += 1
+            if not success:
+                time.sleep(0.1)
+
     def set_resolution(self, index: int=1, verbose: bool=False):
         try:
             if verbose:
@@ -34,7 +68,7 @@ class ESP32Getter():
                 print("available resolutions\n{}".format(resolutions))
 
             if index in [10, 9, 8, 7, 6, 5, 4, 3, 0]:
-                requests.get(self.url + "/control?var=framesize&val={}".format(index))
+                _http.get("http://{}/control?var=framesize&val={}".format(self.url, index), timeout=(1.0, 2.0))
             else:
                 print("Wrong index")
         except:
@@ -43,27 +77,31 @@ class ESP32Getter():
     def set_quality(self, value: int=1, verbose: bool=False):
         try:
             if value >= 10 and value <=63:
-                requests.get(self.url + "/control?var=quality&val={}".format(value))
+                _http.get("http://{}/control?var=quality&val={}".format(self.url, value), timeout=(1.0, 2.0))
         except:
             print("SET_QUALITY: something went wrong")
 
     def set_awb(self, awb: int=1):
         try:
             awb = not awb
-            requests.get(self.url + "/control?var=awb&val={}".format(1 if awb else 0))
+            _http.get("http://{}/control?var=awb&val={}".format(self.url, 1 if awb else 0), timeout=(1.0, 2.0))
         except:
             print("SET_QUALITY: something went wrong")
         return awb
     
     def get_frame(self):
-        success, frame = self.cap.read()
+        with self._lock:
+            frame = self._latest
 
-        if success:
+        if frame is not None:
             return cv2.flip(frame, 0)
         else:
             return None
     
     def destroy(self):
+        self._stop = True
+        # the reader is a daemon thread, so don't hang here if cap.read() is stalled
+        self._thread.join(timeout=2.0)
         self.cap.release()
         cv2.destroyAllWindows()
 
@@ -73,15 +111,26 @@ if __name__ == '__main__':
 
     url1 = "192.168.137.50"
     esp1 = ESP32Getter(url1, type="rtsp")
+    last_count = 0
     while True:
-        frame = esp1.get_frame()
+        # get_frame() no longer blocks, so only flip and draw when the reader has a new frame
+        is_new_frame = esp1.frame_count != last_count
+        if is_new_frame:
+            last_count = esp1.frame_count
+            frame = esp1.get_frame()
 
-        if frame is not None:
-            cv2.imshow("frame", frame)
+            if frame is not None:
+                cv2.imshow("frame", frame)
 
-        key = cv2.waitKey(1)
+        # pollKey() returns immediately instead of sleeping 1 ms (OpenCV < 4.5 lacks it)
+        try:
+            key = cv2.pollKey()
+        except AttributeError:
+            key = cv2.waitKey(1)
 
         if key == 27:
             break
+        if not is_new_frame:
+            time.sleep(0.005)
     
     esp1.destroy()
\ No newline at end of file
@@ -3,18 +3,37 @@ import numpy as np
 import requests
 import sys
 import time
+import threading
+import asyncio
 import subprocess
-import pandas as pd
+import csv
+import hashlib
 import os
+import shutil
 from os.path import join, abspath, dirname, exists
 from datetime import datetime
 
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+try:
+    import aiofiles
+except ImportError:
+    aiofiles = None
+
 '''
 このスクリプトは以下の機能を持ちます:
 1. ESP32カメラの映像をリアルタイムで表示します。
 2. 最新のスナップショットを常に上書き保存します。
 3. 'log/(年)/(月)' フォルダを自動作成し、過去の写真を日付フォルダに分けてすべて保存します。
-4. カメラの状態ログ(CSV)を保存します（新しいものが一番上に来るように）。
+4. カメラの状態ログ(CSV)を保存します（数回分まとめて末尾に追記します）。
 5. 保存した画像とCSVファイルをGitHubに自動でプッシュします。
 '''
 
@@ -23,7 +42,9 @@ from datetime import datetime
 # ==============================================================================
 # ESP32カメラのIPアドレス
 ESP32_IP_ADDRESS = "192.168.137.50"
-# 映像ストリームの形式 ("rtsp" または "http")
+# 映像ストリームの形式 ("rtsp", "http" または "http_mjpeg")
+# "http_mjpeg" は http://(IP)/stream のMJPEGを直接受け取り、RTSPの受信キューを経由しない
+# (カメラのファームウェアが /stream を提供している場合のみ使用可能)
 STREAM_TYPE = "rtsp"
 
 # 保存するファイル名
@@ -33,144 +54,581 @@ LOG_CSV_FILE = "camera_log.csv"
 
 # 定期的に保存・プッシュする間隔（秒）
 UPDATE_INTERVAL = 60
+# ライブ表示の縮小率 (保存する画像は元の解像度のまま)
+DISPLAY_SCALE = 0.5
+# 保存するJPEGの画質 (0-100)
+JPEG_QUALITY = 85
+# CSVログを何件ごとにまとめて書き込むか (件数に達しなくても、この秒数が経てば書き込む)
+FLUSH_EVERY = 5
+FLUSH_INTERVAL = 300
+# pushはコミットがこの件数たまるか、前回のpushからこの秒数が経ったときにまとめて行う
+PUSH_EVERY = 6
+PUSH_INTERVAL = 300
+# gitコマンド1回あたりの待ち時間の上限（秒）。超えたらプロセスを止める
+GIT_TIMEOUT = 120
 # ==============================================================================
 
 BASE_DIR = abspath(dirname(__file__))
 CSV_PATH = join(BASE_DIR, LOG_CSV_FILE)
 
 
-# === ESP32カメラ操作クラス (変更なし) ===
+# カメラへのHTTP通信は1つのSessionで接続を使い回す (ストリーム用と制御用で最大2本)
+_http = requests.Session()
+_http.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+
+# === ESP32カメラ操作クラス ===
 class ESP32Getter():
     def __init__(self, url, type="rtsp") -> None:
         self.url = url
-        if(type=="http"):
+        self.cap = None
+        self._resp = None
+        if(type=="http_mjpeg"):
+            try:
+                self._resp = self._open_mjpeg()
+            except requests.RequestException as e:
+                print(f"エラー: カメラ({self.url})に接続できませんでした。IPアドレスやネットワークを確認してください。 - {e}")
+                sys.exit()
+        elif(type=="http"):
             self.cap = cv2.VideoCapture(f"http://{self.url}")
         elif(type=="rtsp"):
-            self.cap = cv2.VideoCapture(f"rtsp://{self.url}:554/mjpeg/1")
+            # GStreamerのappsinkは処理しきれないフレームを溜めずに捨てる
+            self.cap = cv2.VideoCapture(f"rtspsrc location=rtsp://{self.url}:554/mjpeg/1 latency=0 ! rtpjpegdepay ! jpegdec ! videoconvert ! appsink max-buffers=1 drop=true sync=false", cv2.CAP_GSTREAMER)
+            if not self.cap.isOpened():
+                # GStreamer非対応のOpenCVではFFmpegで開き直す
+                # FFmpeg側でパケットを溜め込まないようにする
+                os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;udp|buffer_size;65536|max_delay;0")
+                self.cap = cv2.VideoCapture(f"rtsp://{self.url}:554/mjpeg/1")
         else:
             print(f"Error: Unsupported type '{type}'")
             sys.exit()
-        
-        if not self.cap.isOpened():
-            print(f"エラー: カメラ({self.url})に接続できませんでした。IPアドレスやネットワークを確認してください。")
-            sys.exit()
+        if self.cap is not None:
+            # 最新の1フレームだけを保持し、古いフレームが返らないようにする
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+            if not self.cap.isOpened():
+                print(f"エラー: カメラ({self.url})に接続できませんでした。IPアドレスやネットワークを確認してください。")
+                sys.exit()
             
         self.set_resolution(index=8)
 
+        # バックグラウンドで読み続け、get_frame()が常に最新フレームを返すようにする
+        self._lock = threading.Lock()
+        # capへのアクセスはリーダースレッドとget_fresh_frame()で排他する
+        self._cap_lock = threading.Lock()
+        self._latest = None
+        # 最初のフレームが届いたことを知らせる (未着とカメラ停止を区別するため)
+        self._first_frame = threading.Event()
+        self._stop = False
+        reader = self._mjpeg_reader if self._resp is not None else self._reader
+        self._thread = threading.Thread(target=reader, daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while not self._stop:
+            with self._cap_lock:
+                success, frame = self.cap.read()
+            with self._lock:
+                self._latest = frame if success else None
+            if success:
+                self._first_frame.set()
+            else:
+                time.sleep(0.1)
+
+    def _open_mjpeg(self):
+        resp = _http.get(f"http://{self.url}/stream", stream=True, timeout=(3, 10))
+        resp.raise_for_status()
+        return resp
+
+    def _mjpeg_reader(self):
+        # 切断されても、待ち時間を倍々に延ばしながら (最大30秒) 再接続し続ける
+        backoff = 1.0
+        while not self._stop:
+            if self._resp is None:
+                try:
+                    self._resp = self._open_mjpeg()
+                    print("[INFO] MJPEGストリームに再接続しました。")
+                except requests.RequestException as e:
+                    print(f"[WARN] MJPEGストリームに再接続できませんでした。{backoff:.0f}秒後に再試行します - {e}")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+            # multipartのストリームからJPEG(SOI〜EOI)を切り出し、一番新しいものだけをデコードする
+            buf = bytearray()
+            try:
+                for chunk in self._resp.iter_content(chunk_size=4096):
+                    if self._stop:
+                        break
+                    buf += chunk
+                    end = buf.rfind(b"\xff\xd9")
+                    if end == -1:
+                        continue
+                    start = buf.rfind(b"\xff\xd8", 0, end)
+                    jpg = bytes(buf[start:end + 2]) if start != -1 else None
+                    # 古いフレームはデコードせずに捨てる
+                    del buf[:end + 2]
+                    if jpg is None:
+                        continue
+                    frame = cv2.imdecode(np.frombuffer(jpg, np.uint8), cv2.IMREAD_COLOR)
+                    with self._lock:
+                        self._latest = frame
+                    self._first_frame.set()
+                    backoff = 1.0
+            except Exception as e:
+                if not self._stop:
+                    print(f"[WARN] MJPEGストリームが切断されました - {e}")
+            with self._lock:
+                self._latest = None
+            resp, self._resp = self._resp, None
+            if resp is not None:
+                resp.close()
+            if not self._stop:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
     def set_resolution(self, index: int=1):
         try:
-            requests.get(f"http://{self.url}/control?var=framesize&val={index}")
+            # タイムアウトを付けて、カメラが応答しなくても起動が止まらないようにする
+            _http.get(f"http://{self.url}/control?var=framesize&val={index}", timeout=(1.0, 2.0))
         except Exception as e:
             print(f"SET_RESOLUTION: 解像度の設定に失敗しました - {e}")
 
+    def wait_for_first_frame(self, timeout: float=None) -> bool:
+        return self._first_frame.wait(timeout)
+
     def get_frame(self):
-        success, frame = self.cap.read()
-        return frame if success else None
+        with self._lock:
+            return self._latest
+    
+    def get_fresh_frame(self):
+        # HTTP MJPEGではリーダーが常に最新のJPEGだけを残しているので、そのまま返す
+        if self.cap is None:
+            return self.get_frame()
+        # バッファに溜まったフレームはgrab()がすぐ返るので、待ちが発生するまで読み捨てる
+        with self._cap_lock:
+            t0 = time.perf_counter()
+            while self.cap.grab():
+                if time.perf_counter() - t0 > 0.02:
+                    break
+                t0 = time.perf_counter()
+            success, frame = self.cap.retrieve()
+        if not success:
+            return None
+        with self._lock:
+            self._latest = frame
+        return frame
     
     def destroy(self):
-        self.cap.release()
+        self._stop = True
+        resp = self._resp
+        if resp is not None:
+            resp.close()
+        # 読み込みが止まっていても終了できるよう待ち時間を区切る (daemonスレッドなので残っても問題ない)
+        self._thread.join(timeout=2.0)
+        if self.cap is not None:
+            self.cap.release()
         cv2.destroyAllWindows()
 
 
-# === CSVログを更新する関数 (変更なし) ===
-def update_log_csv(status: str, ip: str, image_file: str):
+# === CSVログを更新する関数 ===
+# 1件ごとに読み込み・書き直しをせず、メモリに溜めてまとめて追記する
+_pending_rows: list[list] = []
+_last_flush = time.monotonic()
+# ワーカーと定期書き出しの両方から呼ばれるため排他する
+_csv_lock = threading.RLock()
+
+def update_log_csv(timestamp: str, status: str, ip: str, image_file: str):
+    with _csv_lock:
+        _pending_rows.append([timestamp, ip, status, image_file])
+        print(f"[CSV] ログを追加しました ({len(_pending_rows)}/{FLUSH_EVERY} 件待機中)。")
+        if len(_pending_rows) >= FLUSH_EVERY:
+            flush_log_csv()
+        else:
+            flush_log_csv_if_due()
+
+
+def flush_log_csv_if_due() -> bool:
+    with _csv_lock:
+        if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+            return flush_log_csv()
+        return False
+
+
+def flush_log_csv() -> bool:
+    # 実際にCSVへ書き込んだときだけTrueを返す
+    global _last_flush
+    with _csv_lock:
+        _last_flush = time.monotonic()
+        if not _pending_rows:
+            return False
+        return _write_pending_rows()
+
+
+def _write_pending_rows() -> bool:
     print("[CSV] ログファイルを更新します...")
     try:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        new_log_df = pd.DataFrame([{"timestamp": timestamp, "camera_ip": ip, "status": status, "snapshot_file": image_file}])
-        if exists(CSV_PATH):
-            existing_df = pd.read_csv(CSV_PATH)
-            combined_df = pd.concat([new_log_df, existing_df], ignore_index=True)
-            combined_df.to_csv(CSV_PATH, index=False, encoding='utf-8-sig')
-            print(f"[CSV] {LOG_CSV_FILE} の先頭に情報を追記しました。")
-        else:
-            new_log_df.to_csv(CSV_PATH, index=False, encoding='utf-8-sig')
+        new_file = not exists(CSV_PATH)
+        with open(CSV_PATH, 'a', newline='', encoding='utf-8-sig') as f:
+            # 既存のログ(pandasで作成)と同じLF改行にそろえる
+            writer = csv.writer(f, lineterminator='\n')
+            if new_file:
+                writer.writerow(["timestamp", "camera_ip", "status", "snapshot_file"])
+            writer.writerows(_pending_rows)
+        if new_file:
             print(f"[CSV] {LOG_CSV_FILE} を新規作成しました。")
+        else:
+            print(f"[CSV] {LOG_CSV_FILE} に{len(_pending_rows)}件を追記しました。")
+        _pending_rows.clear()
+        return True
     except PermissionError:
         print(f"[CSV ERROR] 書き込みが拒否されました。'{LOG_CSV_FILE}'がExcelなどで開かれていないか確認してください。")
     except Exception as e:
         print(f"[CSV ERROR] CSVファイルの書き込みに失敗しました: {e}")
+    return False
+
+
+# === Gitへコミットとプッシュを行う関数 ===
+# pygit2があればリポジトリを一度だけ開いておき、add/commitをプロセス内で行う
+_repo = None
+
+def open_git_repo():
+    if pygit2 is None:
+        print("[GIT] pygit2が見つからないため、gitコマンドを使用します。")
+        return None
+    try:
+        return pygit2.Repository(BASE_DIR)
+    except pygit2.GitError as e:
+        print(f"[GIT ERROR] リポジトリを開けませんでした。gitコマンドを使用します: {e}")
+        return None
+
+
+# pygit2の操作はスレッド上で行うため、同じRepository/indexに2本のスレッドが触れないようにする
+_pygit2_lock = threading.Lock()
+
+def _commit_with_pygit2(commit_message: str) -> bool:
+    with _pygit2_lock:
+        return _commit_with_pygit2_locked(commit_message)
+
+
+def _commit_with_pygit2_locked(commit_message: str) -> bool:
+    try:
+        # 作業ツリーが変更されていなければ何もしない
+        if not _repo.status():
+            return False
+        index = _repo.index
+        index.add_all()
+        index.write()
+        tree = index.write_tree()
+        parent = _repo.head.peel(pygit2.Commit)
+        if tree == parent.tree_id:
+            return False
+        signature = _repo.default_signature
+        _repo.create_commit("HEAD", signature, signature, commit_message, tree, [parent.id])
+        return True
+    except (pygit2.GitError, KeyError) as e:
+        print(f"[GIT ERROR] コミットに失敗しました: {e}")
+        return False
+
+
+async def _run_git(*args: str, capture: bool=False) -> bytes:
+    stream = asyncio.subprocess.PIPE if capture else None
+    proc = await asyncio.create_subprocess_exec("git", *args, cwd=BASE_DIR, stdout=stream, stderr=stream)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=GIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        # pushが止まっても終了処理が固まらないよう、時間切れのプロセスは止める
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(["git", *args], GIT_TIMEOUT)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, ["git", *args], stdout, stderr)
+    return stdout
+
+
+async def _commit_with_git_cli(commit_message: str) -> bool:
+    # 作業ツリーが変更されていなければadd/commitを起動しない
+    status = await _run_git("status", "--porcelain", "-z", capture=True)
+    if not status:
+        return False
+    await _run_git("add", ".")
+    # 出力はパイプで受け取り、"nothing to commit" ならpushしない
+    try:
+        await _run_git("commit", "-m", commit_message, capture=True)
+    except subprocess.CalledProcessError as e:
+        if b"nothing to commit" in (e.stdout or b"") + (e.stderr or b""):
+            return False
+        raise
+    return True
+
+
+# コミットは毎回ローカルで行い、pushは数回分をまとめて行う
+_commits_since_push = 0
+_last_push = time.monotonic()
+# 定期処理と定期pushチェックが同時にgitを操作しないようにする
+# (Python 3.9ではLockが生成時のイベントループに紐づくため、asyncio.run()の中で初めて作る)
+_git_lock = None
+
+def _get_git_lock() -> asyncio.Lock:
+    global _git_lock
+    if _git_lock is None:
+        _git_lock = asyncio.Lock()
+    return _git_lock
+
+async def git_commit_and_push(timestamp: str, force_push: bool=False):
+    global _commits_since_push
+    async with _get_git_lock():
+        print("[GIT] 変更をコミットします...")
+        try:
+            commit_message = f"Auto-update: {timestamp}"
+            if _repo is not None:
+                committed = await asyncio.to_thread(_commit_with_pygit2, commit_message)
+            else:
+                committed = await _commit_with_git_cli(commit_message)
+            if committed:
+                _commits_since_push += 1
+            else:
+                print("[GIT] 変更がなかったため、コミットはスキップされました。")
+        except FileNotFoundError:
+             print("[GIT ERROR] 'git'コマンドが見つかりません。Gitがインストールされ、PATHが通っているか確認してください。")
+        except subprocess.CalledProcessError as e:
+            output = (e.stdout or b"") + (e.stderr or b"")
+            print(f"[GIT ERROR] コミットに失敗しました: {e}\n{output.decode(errors='replace').strip()}")
+        except subprocess.TimeoutExpired as e:
+            print(f"[GIT ERROR] コミットが時間内に終わりませんでした: {e}")
+        await _push_if_due(force_push, verbose=True)
 
 
-# === Gitへコミットとプッシュを行う関数 (変更なし) ===
-def git_commit_and_push():
+async def git_push_if_due():
+    # 映像に変化がなくコミットが増えない間も、PUSH_INTERVALが過ぎたら未pushのコミットを送る
+    async with _get_git_lock():
+        await _push_if_due(False, verbose=False)
+
+
+async def _push_if_due(force_push: bool, verbose: bool):
+    global _commits_since_push, _last_push
+    if _commits_since_push == 0:
+        return
+    if not force_push and _commits_since_push < PUSH_EVERY and time.monotonic() - _last_push < PUSH_INTERVAL:
+        if verbose:
+            print(f"[GIT] pushは後でまとめて行います ({_commits_since_push}/{PUSH_EVERY} 件)。")
+        return
     print("[GIT] GitHubへ変更をプッシュします...")
     try:
-        commit_message = f"Auto-update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        subprocess.run(["git", "add", "."], check=True, cwd=BASE_DIR)
-        subprocess.run(["git", "commit", "-m", commit_message], check=True, cwd=BASE_DIR)
-        subprocess.run(["git", "push", "origin", "main"], check=True, cwd=BASE_DIR)
+        # pushは認証情報ヘルパーを使えるようgitコマンドに任せる
+        await _run_git("push", "origin", "main")
+        _commits_since_push = 0
+        _last_push = time.monotonic()
         print("[GIT] Push 成功！")
     except FileNotFoundError:
          print("[GIT ERROR] 'git'コマンドが見つかりません。Gitがインストールされ、PATHが通っているか確認してください。")
     except subprocess.CalledProcessError as e:
-        if "nothing to commit" in str(e.stderr) or "nothing to commit" in str(e.stdout):
-             print("[GIT] 変更がなかったため、コミットはスキップされました。")
-        else:
-            print(f"[GIT ERROR] Pushに失敗しました: {e}")
+        output = (e.stdout or b"") + (e.stderr or b"")
+        print(f"[GIT ERROR] Pushに失敗しました: {e}\n{output.decode(errors='replace').strip()}")
+    except subprocess.TimeoutExpired as e:
+        print(f"[GIT ERROR] Pushが時間内に終わりませんでした: {e}")
+
+
+# === JPEGエンコード ===
+# libjpeg-turbo(SIMD)が使えればそちらで、なければOpenCVで1回だけエンコードする
+def _load_turbojpeg():
+    if TurboJPEG is None:
+        return None
+    # ラッパーだけ入っていてlibturbojpeg本体が無い場合もOpenCVで続行する
+    try:
+        return TurboJPEG()
+    except (RuntimeError, OSError) as e:
+        print(f"[JPEG] libturbojpegを読み込めないため、OpenCVでエンコードします: {e}")
+        return None
+
+
+_tj = _load_turbojpeg()
+# エンコードパラメータは毎回作らず使い回す (TurboJPEG側はquality=JPEG_QUALITYに相当)
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 0, cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+
+def encode_jpeg(frame) -> bytes:
+    if _tj is not None:
+        return _tj.encode(frame, quality=JPEG_QUALITY)
+    success, buf = cv2.imencode(".jpg", frame, JPEG_PARAMS)
+    if not success:
+        raise RuntimeError("JPEGエンコードに失敗しました")
+    return buf.tobytes()
+
+
+def _write_bytes_sync(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+async def write_bytes(path: str, data: bytes):
+    if aiofiles is None:
+        await asyncio.to_thread(_write_bytes_sync, path, data)
+        return
+    async with aiofiles.open(path, 'wb') as f:
+        await f.write(data)
+
+
+# === 定期処理 (スナップショット保存、CSV、Git) ===
+# 重いディスク・Git処理は別タスクで行い、メインループはフレーム表示に専念させる
+# 最後に作成したアーカイブフォルダ (月が変わるまでmakedirsを呼ばない)
+_last_archive_dir = None
+
+async def save_snapshot(frame, now: datetime, camera_status: str):
+    global _last_archive_dir
+    # 時刻は1回だけ取得して、ファイル名・CSV・コミットで同じものを使う
+    ts_full = now.strftime('%Y%m%d_%H%M%S')
+    ts_human = now.strftime('%Y-%m-%d %H:%M:%S')
+    year_str, month_str = f"{now.year:04d}", f"{now.month:02d}"
+    print(f"\n--- 定期処理開始 ({now:%H:%M:%S}) ---")
+
+    jpeg_bytes = await asyncio.to_thread(encode_jpeg, frame)
+    main_snapshot_path = join(BASE_DIR, SNAPSHOT_IMAGE_FILE)
+    # アーカイブ側とハードリンクを共有するため、上書きせず別ファイルに書いて置き換える
+    tmp_snapshot_path = f"{main_snapshot_path}.tmp"
+    await write_bytes(tmp_snapshot_path, jpeg_bytes)
+    os.replace(tmp_snapshot_path, main_snapshot_path)
+    print(f"[SAVE] {SNAPSHOT_IMAGE_FILE} を更新しました。")
+
+    # 保存したファイルが空でないことだけを確認する (再デコードはしない)
+    if os.path.getsize(main_snapshot_path) == 0:
+        print("[VERIFY] 保存したスナップショットが空です。")
+
+    relative_archive_dir = f"log/{year_str}/{month_str}"
+    archive_dir_path = f"{BASE_DIR}/{relative_archive_dir}"
+    if archive_dir_path != _last_archive_dir:
+        os.makedirs(archive_dir_path, exist_ok=True)
+        _last_archive_dir = archive_dir_path
+    archive_filename = f"{SNAPSHOT_FILE_PREFIX}_{ts_full}.jpg"
+    archive_full_path = f"{archive_dir_path}/{archive_filename}"
+    # 同じ内容を書き直さず、ハードリンク (できなければファイルコピー) で保存する
+    try:
+        os.link(main_snapshot_path, archive_full_path)
+    except OSError:
+        await asyncio.to_thread(shutil.copyfile, main_snapshot_path, archive_full_path)
+    print(f"[ARCHIVE] {archive_filename} を {relative_archive_dir} に保存しました。")
+    csv_record_path = f"{relative_archive_dir}/{archive_filename}"
+    await asyncio.to_thread(update_log_csv, ts_human, camera_status, ESP32_IP_ADDRESS, csv_record_path)
+    await git_commit_and_push(ts_human)
+
+    print("--- 定期処理完了 ---\n")
+
+
+async def _worker(work_q: asyncio.Queue):
+    while True:
+        frame, now, camera_status = await work_q.get()
+        try:
+            await save_snapshot(frame, now, camera_status)
+        except Exception as e:
+            print(f"[ERROR] 定期処理中にエラーが発生しました: {e}")
+        finally:
+            work_q.task_done()
+
+
+async def _housekeeping():
+    # 映像に変化がなく定期処理がスキップされ続けても、溜まったログと未pushのコミットを時間で送り出す
+    while True:
+        await asyncio.sleep(UPDATE_INTERVAL)
+        # 1回の失敗でタイマーが止まらないよう、エラーは記録して次に進む
+        try:
+            if await asyncio.to_thread(flush_log_csv_if_due):
+                # 書き出したログをコミットする (pushはいつもどおりまとめて行う)
+                await git_commit_and_push(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            else:
+                await git_push_if_due()
+        except Exception as e:
+            print(f"[ERROR] 定期書き出し中にエラーが発生しました: {e}")
+
+
+def frame_digest(frame) -> bytes:
+    # 16x16のグレースケールに縮小し、ノイズで変わらないよう輝度を16段階に丸めてからハッシュを取る
+    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (16, 16), interpolation=cv2.INTER_AREA)
+    return hashlib.blake2b((small >> 4).tobytes(), digest_size=16).digest()
 
 
 # === メインの実行部分 ===
-if __name__ == '__main__':
+async def main():
+    global _repo
     esp1 = ESP32Getter(ESP32_IP_ADDRESS, type=STREAM_TYPE)
+    _repo = open_git_repo()
+    work_q = asyncio.Queue(maxsize=2)
+    worker = asyncio.create_task(_worker(work_q))
     last_update_time = time.monotonic() - UPDATE_INTERVAL
+    last_shown = None
+    prev_hash = None
+
+    # 起動直後はまだフレームが無いので、カメラ停止と誤判定しないよう最初のフレームを待つ
+    if not await asyncio.to_thread(esp1.wait_for_first_frame, 10.0):
+        print("[WARN] 10秒待ってもフレームが届きませんでした。カメラとの接続を確認してください。")
 
     print("カメラ映像を表示します。ESCキーで終了します。")
-    print(f"{UPDATE_INTERVAL}秒ごとにスナップショットとログをGitHubにプッシュします。")
+    print(f"{UPDATE_INTERVAL}秒ごとにスナップショットとログをコミットし、GitHubへはまとめてプッシュします。")
 
-    while True:
-        frame = esp1.get_frame()
-        camera_status = "ONLINE"
+    housekeeping = asyncio.create_task(_housekeeping())
+    try:
+        while True:
+            frame = esp1.get_frame()
+            camera_status = "ONLINE"
+            # リーダースレッドが新しいフレームを置いたときだけ描画する
+            is_new_frame = frame is not last_shown
 
-        if frame is not None:
-            cv2.imshow("ESP32 Camera Stream (Live)", frame)
-        else:
-            print("[WARN] フレームを取得できませんでした。カメラとの接続を確認してください。")
-            camera_status = "OFFLINE"
-            time.sleep(1)
-            continue
+            if frame is not None:
+                if is_new_frame:
+                    display = frame
+                    if DISPLAY_SCALE != 1:
+                        # OpenCLが使えればUMat経由でGPU側で縮小する
+                        src = cv2.UMat(frame) if cv2.ocl.useOpenCL() else frame
+                        display = cv2.resize(src, None, fx=DISPLAY_SCALE, fy=DISPLAY_SCALE, interpolation=cv2.INTER_AREA)
+                    cv2.imshow("ESP32 Camera Stream (Live)", display)
+                    last_shown = frame
+            else:
+                print("[WARN] フレームを取得できませんでした。カメラとの接続を確認してください。")
+                camera_status = "OFFLINE"
+                await asyncio.sleep(1)
+                continue
 
-        if time.monotonic() - last_update_time >= UPDATE_INTERVAL:
-            print(f"\n--- 定期処理開始 ({datetime.now().strftime('%H:%M:%S')}) ---")
-            
-            main_snapshot_path = join(BASE_DIR, SNAPSHOT_IMAGE_FILE)
-            cv2.imwrite(main_snapshot_path, frame)
-            print(f"[SAVE] {SNAPSHOT_IMAGE_FILE} を更新しました。")
+            if time.monotonic() - last_update_time >= UPDATE_INTERVAL:
+                # 保存するのは古いバッファではなく「今」のフレームにする
+                fresh_frame = await asyncio.to_thread(esp1.get_fresh_frame)
+                if fresh_frame is not None:
+                    frame = fresh_frame
+                # 前回保存したときと映像が変わっていなければ、保存・CSV・Gitをすべて省く
+                frame_hash = frame_digest(frame)
+                if frame_hash == prev_hash:
+                    print("[SKIP] 映像に変化がないため、今回の定期処理はスキップします。")
+                else:
+                    try:
+                        work_q.put_nowait((frame.copy(), datetime.now(), camera_status))
+                        prev_hash = frame_hash
+                    except asyncio.QueueFull:
+                        print("[WARN] 前回の定期処理が終わっていないため、今回はスキップします。")
+                last_update_time = time.monotonic()
 
-            # ★★★ 確認用の処理を追加 ★★★
-            # 保存したばかりのファイルをディスクから読み込んで、更新されているか確認する
+            # pollKey()は1ms待たずにすぐ返る (OpenCV 4.5未満ではwaitKey(1)を使う)
             try:
-                saved_frame = cv2.imread(main_snapshot_path)
-                if saved_frame is not None:
-                    # 確認用の別ウィンドウに表示
-                    cv2.imshow("Saved Snapshot (from file)", saved_frame)
-                else:
-                    print("[VERIFY] 確認用の画像読み込みに失敗しました。")
-            except Exception as e:
-                print(f"[VERIFY ERROR] 確認処理中にエラーが発生: {e}")
-            
-            # --- ここから下のアーカイブ保存、CSV、Git処理は変更なし ---
-            now = datetime.now()
-            year_str = now.strftime('%Y')
-            month_str = now.strftime('%m')
-            archive_dir_path = join(BASE_DIR, "log", year_str, month_str)
-            os.makedirs(archive_dir_path, exist_ok=True)
-            timestamp_str = now.strftime('%Y%m%d_%H%M%S')
-            archive_filename = f"{SNAPSHOT_FILE_PREFIX}_{timestamp_str}.jpg"
-            archive_full_path = join(archive_dir_path, archive_filename)
-            cv2.imwrite(archive_full_path, frame)
-            relative_archive_dir = join("log", year_str, month_str).replace(os.sep, '/')
-            print(f"[ARCHIVE] {archive_filename} を {relative_archive_dir} に保存しました。")
-            csv_record_path = join(relative_archive_dir, archive_filename).replace(os.sep, '/')
-            update_log_csv(camera_status, ESP32_IP_ADDRESS, csv_record_path)
-            git_commit_and_push()
-
-            last_update_time = time.monotonic()
-            print("--- 定期処理完了 ---\n")
-
-        key = cv2.waitKey(1)
-        if key == 27:
-            break
-    
-    print("終了します。")
-    esp1.destroy()
+                key = cv2.pollKey()
+            except AttributeError:
+                key = cv2.waitKey(1)
+            if key == 27:
+                break
+            # 定期処理タスクに実行の機会を与える (新しいフレームが無ければ少し待つ)
+            await asyncio.sleep(0 if is_new_frame else 0.005)
+    finally:
+        # ESCだけでなくCtrl+Cや例外で抜けた場合も、溜まったログを失わないよう後始末する
+        print("終了します。")
+        # 後始末の間に応答しないウィンドウが残らないよう、先にカメラとウィンドウを閉じる
+        esp1.destroy()
+        housekeeping.cancel()
+        # 実行中の定期処理が終わるのを待ってから残りのログを書き出す
+        try:
+            await asyncio.wait_for(work_q.join(), timeout=60)
+        except asyncio.TimeoutError:
+            print("[WARN] 定期処理が終わらないため、待たずに終了します。")
+        worker.cancel()
+        # キャンセルしたタスクの終了を待ち、最後のコミットと重ならないようにする
+        await asyncio.gather(worker, housekeeping, return_exceptions=True)
+        await asyncio.to_thread(flush_log_csv)
+        # 書き出したログと未pushのコミットをまとめて送る
+        await git_commit_and_push(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), force_push=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())